@@ -1,10 +1,9 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-import jieba
+import numpy as np
 from collections import Counter
-import re
+import io
+import os
 
 # 设置页面配置
 st.set_page_config(page_title="竞品评论深度分析看板", layout="wide")
@@ -12,32 +11,126 @@ st.set_page_config(page_title="竞品评论深度分析看板", layout="wide")
 st.title("🛍️ 竞品评论深度分析看板")
 st.markdown("上传卖家精灵导出的评论表格（Excel/CSV），自动分析消费者画像与痛点。")
 
+# 停用词表（可根据需要添加更多产品相关停用词），统一小写并使用集合以加速查找。
+# 停用词在分词之后按整词过滤：若在原文上按字符串匹配剔除，'的'、'a' 等单字会误伤'的确'、'and' 等词
+STOPWORDS = frozenset(w.lower() for w in [
+    '的', '了', '是', '我', '在', '和', '也', '都', '就', '用', '有', '很', '买', 
+    '一个', '这款', '这个', '使用', '感觉', '可以', '非常', '就是', '不过', 
+    '自己', '那里', '什么', '所以', '会', '它', '它家', '它能', 
+    'the', 'and', 'to', 'a', 'of', 'it', 'is', 'in', 'for'
+])
+
+# 文本清洗正则（模块级常量）：保留各语言的字母和数字（含中日韩文字、德法西意等带重音字母、全角字符）、
+# 下划线和空白，去除标点及特殊符号。该模式交给 Arrow 的 RE2 引擎执行，而 RE2 的 \w、\s 只匹配 ASCII，
+# 因此改用 Unicode 类别 \p{L}、\p{N}、\p{Z}（后者含不换行空格和全角空格）
+_CLEAN_PATTERN = '[^\\p{L}\\p{N}_\\s\\p{Z}]'
+
+# 并行分词的进程数上限，避免在小容器中启动过多进程、每个进程各复制一份词典
+_MAX_JIEBA_WORKERS = 4
+
+# --- 延迟导入（jieba、plotly 导入较慢，延迟到真正分析时才加载，未上传文件时首页可以更快渲染） ---
+
+@st.cache_resource
+def _jieba_tokenizer():
+    """导入并预加载 jieba 词典与前缀树，每个进程只加载一次。"""
+    import jieba
+    jieba.initialize()
+    # 多进程并行分词需通过环境变量 JIEBA_PARALLEL_WORKERS 显式开启（仅 POSIX）：jieba 以 fork 创建进程池，
+    # 而 Streamlit 服务进程中有多个线程在运行，fork 存在死锁风险；并行模式还会先收集全部分词结果再返回，
+    # 失去逐词流式计数的内存优势。缓存清空或脚本修改后会重新执行本函数，先关闭旧的进程池，避免遗留进程
+    jieba.disable_parallel()
+    workers = _jieba_workers()
+    if workers > 1 and os.name != 'nt':
+        jieba.enable_parallel(workers)
+    return jieba
+
+def _jieba_workers():
+    """并行分词的进程数，取环境变量 JIEBA_PARALLEL_WORKERS，未设置或无效时为 1（不开启并行）。"""
+    try:
+        requested = int(os.environ.get('JIEBA_PARALLEL_WORKERS', '1'))
+    except ValueError:
+        return 1
+    # sched_getaffinity 反映当前进程实际可用的 CPU，cpu_count 返回的是宿主机的总核数
+    if hasattr(os, 'sched_getaffinity'):
+        available = len(os.sched_getaffinity(0))
+    else:
+        available = os.cpu_count() or 1
+    return max(1, min(requested, available, _MAX_JIEBA_WORKERS))
+
+@st.cache_resource
+def _px():
+    """导入 plotly.express，每个进程只导入一次。"""
+    import plotly.express as px
+    return px
+
 # --- 核心处理函数 ---
 
-def clean_text(text):
-    """文本清洗：去除特殊符号，保留中文和英文。"""
-    if pd.isna(text):
-        return ""
-    # 去除特殊符号，保留中文和英文，并转换为字符串
-    return re.sub(r'[^\w\s\u4e00-\u9fa5]', '', str(text))
+def _read_file(file_bytes, name, **kwargs):
+    """根据文件类型读取上传的文件内容，额外参数透传给 pandas。"""
+    buffer = io.BytesIO(file_bytes)
+    if name.endswith('.csv'):
+        return pd.read_csv(buffer, **kwargs)
+    try:
+        # 优先使用 calamine 引擎（需安装 python-calamine），解析速度远快于 openpyxl
+        return pd.read_excel(buffer, engine='calamine', **kwargs)
+    except (ImportError, ValueError):
+        buffer.seek(0)
+        return pd.read_excel(buffer, engine='openpyxl', **kwargs)
 
-def get_keywords(text_series, top_n=20):
-    """分词并统计高频关键词。"""
-    text_combined = " ".join(text_series.dropna().astype(str).tolist())
-    
-    # 基础分词
-    words = jieba.lcut(text_combined)
-    
-    # 停用词过滤（可根据需要添加更多产品相关停用词）
-    stopwords = [
-        '的', '了', '是', '我', '在', '和', '也', '都', '就', '用', '有', '很', '买', 
-        '一个', '这款', '这个', '使用', '感觉', '可以', '非常', '就是', '不过', 
-        '自己', '那里', '什么', '所以', '会', '它', '它家', '它能', 
-        'the', 'and', 'to', 'a', 'of', 'it', 'is', 'in', 'for'
-    ]
-    # 过滤掉长度小于2的词和停用词
-    filtered_words = [w.strip() for w in words if len(w.strip()) > 1 and w.lower() not in stopwords]
-    return Counter(filtered_words).most_common(top_n)
+@st.cache_data(show_spinner=False)
+def _load_columns(file_bytes, name):
+    """只读取表头，供用户在侧边栏选择需要分析的列。"""
+    return _read_file(file_bytes, name, nrows=0).columns.tolist()
+
+@st.cache_data(show_spinner=False)
+def _load_df(file_bytes, name, usecols, content_col):
+    """只读取选中的列，以文件字节、文件名和所选列为缓存键，避免每次重绘都重新解析。"""
+    # 评论内容在解析时直接读为 Arrow 字符串类型，后续的 .str 操作在连续的 UTF-8 缓冲区上执行
+    # CSV 沿用默认的 C 引擎：评论单元格内常含换行，pandas 的 pyarrow 引擎无法解析；
+    # 且与读表头时使用同一引擎，保证重复或空白列名的命名一致，usecols 才能对上
+    return _read_file(file_bytes, name, usecols=list(usecols), dtype={content_col: 'string[pyarrow]'})
+
+def clean_text(text_series):
+    """文本清洗：去除特殊符号，保留各语言的文字和数字。对整列做向量化处理，而非逐行调用。"""
+    # 输入为 string[pyarrow] 列，传入模式字符串由 Arrow (RE2) 执行（Python re 不支持 \p{...}）；
+    # 若传入编译后的 re 对象，pandas 会退回逐行调用 Python re
+    return text_series.str.replace(_CLEAN_PATTERN, '', regex=True).fillna("")
+
+@st.cache_data(show_spinner=False)
+def count_keywords(text_series, group_series):
+    """每条评论只分词一次，并按分组（好评/差评）汇总词频。
+
+    结果按内容缓存且只保存各组的 Counter，交互重绘时既不重新分词计数，也不保留逐条评论的分词结果。
+    """
+    groups = group_series.tolist()
+    counters = {g: Counter() for g in set(groups)}
+    if text_series.empty:
+        return counters
+
+    # 开启并行分词时任务按行切分，因此把所有评论以换行拼接成一个大文本整体分词，
+    # 再按换行拆回每条评论；评论内部的空白（含不换行空格、全角空格等 Unicode 空白）先统一替换为空格，
+    # 保证换行只出现在评论之间，且各类空白仍能分隔词语。
+    # str.cat 在 pandas/Arrow 内部拼接，不生成中间 Python 列表；na_rep 保证空值也占一行，拆分后不错位
+    blob = text_series.str.replace(r'[\s\p{Z}]+', ' ', regex=True).str.cat(sep='\n', na_rep='')
+    # 关闭 HMM 新词发现（约快一倍）：HMM 主要帮助识别生僻品牌名等未登录词，
+    # 对高频词 Top-N 统计的排名几乎没有影响
+    row = 0
+    counter = counters[groups[row]]
+    for w in _jieba_tokenizer().cut(blob, HMM=False):
+        if w == '\n':
+            # 进入下一条评论，切换到其所属分组的计数器
+            row += 1
+            counter = counters[groups[row]]
+            continue
+        w = w.strip()
+        # 过滤掉长度小于2的词和停用词（STOPWORDS 为集合，成员判断为 O(1)）
+        if len(w) > 1 and w.lower() not in STOPWORDS:
+            counter[w] += 1
+    return counters
+
+def get_keywords(counters, group, top_n=20):
+    """取出某一分组的高频关键词。"""
+    return counters.get(group, Counter()).most_common(top_n)
 
 # **【重要修复】**：增加 try-except 逻辑和强制类型转换，解决TypeError和IndentationError后的鲁棒性问题
 def analyze_sentiment_group(df, rating_col):
@@ -50,26 +143,55 @@ def analyze_sentiment_group(df, rating_col):
     df['Numeric_Rating'] = df['Numeric_Rating'].fillna(4) 
     
     # 基于数字评分进行情感分组：<=3 为差评/痛点；>3 为好评/卖点
-    df['Sentiment'] = df['Numeric_Rating'].apply(
-        lambda x: '差评 (痛点)' if x <= 3 else '好评 (卖点)'
+    # 使用 np.where 整列向量化计算，并存为只有两个类别的 Categorical 以节省内存
+    ratings = df['Numeric_Rating'].to_numpy()
+    df['Sentiment'] = pd.Categorical(
+        np.where(ratings <= 3, '差评 (痛点)', '好评 (卖点)'),
+        categories=['差评 (痛点)', '好评 (卖点)']
     )
+    
+    # 评分全部是 0-255 内的整数时存为 uint8，比较、计数和分组只需处理 1 字节而非 8 字节；
+    # 含小数或超出范围时保留浮点，避免改变平均分和差评占比
+    if ((ratings >= 0) & (ratings <= 255) & (ratings == np.floor(ratings))).all():
+        df['Numeric_Rating'] = df['Numeric_Rating'].astype('uint8')
     return df
 
+# --- 图表构建函数（结果缓存，输入数据不变时直接复用已生成的图表） ---
+
+@st.cache_data(show_spinner=False)
+def build_rating_bar(rating_counts):
+    """星级分布柱状图。"""
+    return _px().bar(rating_counts, title="星级分布图", labels={'index':'星级', 'value':'数量'})
+
+@st.cache_data(show_spinner=False)
+def build_keyword_bar(word_df, word_col, title, color_scale):
+    """高频关键词横向柱状图，按频率从高到低排列。"""
+    fig = _px().bar(word_df, x='频率', y=word_col, orientation='h', 
+                 title=title, color='频率', color_continuous_scale=color_scale)
+    fig.update_layout(yaxis={'categoryorder':'total ascending'})
+    return fig
+
+@st.cache_data(show_spinner=False)
+def build_variant_bar(variant_df, variant_col):
+    """各变体平均评分对比图。"""
+    return _px().bar(variant_df, 
+                  x=variant_col, 
+                  y='avg_rating', 
+                  color='avg_rating',
+                  title="各变体平均评分对比",
+                  color_continuous_scale=_px().colors.sequential.Plasma,
+                  text_auto='.2f')
+
 # --- 侧边栏：数据上传与列映射 ---
 uploaded_file = st.sidebar.file_uploader("请上传评论 Excel/CSV 文件", type=['xlsx', 'csv'])
 
 if uploaded_file:
     try:
-        # 根据文件类型读取数据
-        if uploaded_file.name.endswith('.csv'):
-            df = pd.read_csv(uploaded_file)
-        else:
-            df = pd.read_excel(uploaded_file)
-        
-        st.success(f"数据加载成功！共包含 {len(df)} 条评论。")
+        # 先只读取表头用于列映射，选定列后再读取数据（结果均已缓存，拖动滑块等交互不会重复解析文件）
+        file_bytes = uploaded_file.getvalue()
+        columns = _load_columns(file_bytes, uploaded_file.name)
         
         # --- 数据列映射（根据卖家精灵导出格式调整） ---
-        columns = df.columns.tolist()
         st.sidebar.markdown("### 🔧 数据列映射")
         
         # 尝试自动识别常用列名，失败则使用第一个列名
@@ -88,33 +210,47 @@ if uploaded_file:
                                         index=columns.index(get_default_col(['date', 'time', 'publish'])) + 1)
         variant_col = st.sidebar.selectbox("选择变体/SKU列 (可选)", ['无'] + columns)
 
+        # 只读取分析需要的列（去重并跳过未选择的列）
+        usecols = tuple(dict.fromkeys(c for c in [rating_col, content_col, date_col, variant_col] if c != '无'))
+        df = _load_df(file_bytes, uploaded_file.name, usecols, content_col)
+        
+        st.success(f"数据加载成功！共包含 {len(df)} 条评论。")
+
         # 数据预处理
         df = analyze_sentiment_group(df, rating_col)
-        df['Cleaned_Content'] = df[content_col].apply(clean_text)
+        df['Cleaned_Content'] = clean_text(df[content_col])
+        keyword_counts = count_keywords(df['Cleaned_Content'], df['Sentiment'])
 
         # --- 第一部分：宏观概览 (评分与趋势) ---
         st.header("1. 宏观数据概览")
         c1, c2, c3 = st.columns(3)
-        avg_rating = df['Numeric_Rating'].mean()
+        # 只扫描一次评分列，平均分、总数和差评占比都由各星级计数推导
+        rating_counts = df['Numeric_Rating'].value_counts().sort_index()
+        total = rating_counts.sum()
+        avg_rating = np.dot(rating_counts.index.to_numpy(), rating_counts.to_numpy()) / total
         c1.metric("平均评分", f"{avg_rating:.2f} ⭐")
         c2.metric("评论总数", len(df))
-        c3.metric("差评占比 (<=3星)", f"{(len(df[df['Numeric_Rating']<=3])/len(df)*100):.1f}%")
+        c3.metric("差评占比 (<=3星)", f"{(rating_counts[rating_counts.index <= 3].sum()/total*100):.1f}%")
 
         col1, col2 = st.columns(2)
         with col1:
             st.subheader("评分等级分布")
             # 使用 Numeric_Rating 确保只统计数字评分
-            fig_rating = px.bar(df['Numeric_Rating'].value_counts().sort_index(), 
-                                title="星级分布图", labels={'index':'星级', 'value':'数量'})
+            fig_rating = build_rating_bar(rating_counts)
             st.plotly_chart(fig_rating, use_container_width=True)
         
         with col2:
             st.subheader("评论时间趋势 (判断淡旺季)")
             if date_col != '无':
                 try:
-                    df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
-                    time_trend = df.resample('M', on=date_col).size().reset_index(name='count')
-                    fig_time = px.line(time_trend, x=date_col, y='count', title="月度评论趋势")
+                    # 按月份周期编码直接计数，无需构建重采样器；周期频率 'M' 不受 'ME' 更名影响
+                    dates = pd.to_datetime(df[date_col], errors='coerce')
+                    monthly = dates.dt.to_period('M').value_counts().sort_index()
+                    if not monthly.empty:
+                        # value_counts 不含没有评论的月份，补零以保持连续的时间轴
+                        monthly = monthly.reindex(pd.period_range(monthly.index[0], monthly.index[-1], freq='M'), fill_value=0)
+                    time_trend = pd.DataFrame({date_col: monthly.index.to_timestamp(), 'count': monthly.to_numpy()})
+                    fig_time = _px().line(time_trend, x=date_col, y='count', title="月度评论趋势")
                     st.plotly_chart(fig_time, use_container_width=True)
                 except:
                     st.warning("时间格式解析失败，跳过趋势分析")
@@ -127,16 +263,14 @@ if uploaded_file:
         st.header("2. 消费者画像、购买动机与好评点")
         
         pos_df = df[df['Sentiment'] == '好评 (卖点)']
-        pos_keywords = get_keywords(pos_df['Cleaned_Content'], top_n=20)
+        pos_keywords = get_keywords(keyword_counts, '好评 (卖点)', top_n=20)
         
         c_1, c_2 = st.columns(2)
         with c_1:
             st.subheader("💡 好评点/产品卖点 (Top 10)")
             st.markdown("这些词汇反映了**购买动机**和**产品优势**")
             pos_word_df = pd.DataFrame(pos_keywords, columns=['关键词', '频率']).head(10)
-            fig_pos = px.bar(pos_word_df, x='频率', y='关键词', orientation='h', 
-                             title="好评高频词", color='频率', color_continuous_scale=px.colors.sequential.Greens)
-            fig_pos.update_layout(yaxis={'categoryorder':'total ascending'})
+            fig_pos = build_keyword_bar(pos_word_df, '关键词', "好评高频词", _px().colors.sequential.Greens)
             st.plotly_chart(fig_pos, use_container_width=True)
 
         with c_2:
@@ -161,18 +295,16 @@ if uploaded_file:
             
             with col_neg1:
                 st.subheader("主要差评点/未被满足的需求 (Top 10)")
-                neg_keywords = get_keywords(neg_df['Cleaned_Content'], top_n=10)
+                neg_keywords = get_keywords(keyword_counts, '差评 (痛点)', top_n=10)
                 neg_word_df = pd.DataFrame(neg_keywords, columns=['负面关键词', '频率'])
-                fig_neg = px.bar(neg_word_df, x='频率', y='负面关键词', orientation='h', 
-                                 title="差评高频词", color='频率', color_continuous_scale=px.colors.sequential.Reds)
-                fig_neg.update_layout(yaxis={'categoryorder':'total ascending'})
+                fig_neg = build_keyword_bar(neg_word_df, '负面关键词', "差评高频词", _px().colors.sequential.Reds)
                 st.plotly_chart(fig_neg, use_container_width=True)
             
             with col_neg2:
                 st.subheader("典型差评原文摘要 (Top 5)")
-                # 筛选出最长的5条差评，通常包含最多的细节
-                neg_df['len'] = neg_df[content_col].astype(str).str.len()
-                top_neg_reviews = neg_df.sort_values(by='len', ascending=False).head(5)
+                # 筛选出最长的5条差评，通常包含最多的细节（nlargest 只做部分选择，无需整体排序）
+                top_idx = neg_df[content_col].str.len().nlargest(5).index
+                top_neg_reviews = neg_df.loc[top_idx]
                 
                 for index, row in top_neg_reviews.iterrows():
                     st.error(f"**⭐ {int(row['Numeric_Rating'])}星** | 评论：\n\n> {row[content_col]}")
@@ -185,23 +317,21 @@ if uploaded_file:
             st.markdown("查看不同颜色/尺寸/规格的平均评分差异。")
             
             # 计算各变体的平均评分，并筛选掉评论量过少的变体
-            variant_stats = df.groupby(variant_col).agg(
+            # 分组键转为 Categorical，按整数编码分组而非反复哈希字符串；observed=True 只保留实际出现的变体
+            df[variant_col] = df[variant_col].astype('category')
+            variant_stats = df.groupby(variant_col, observed=True).agg(
                 avg_rating=('Numeric_Rating', 'mean'),
                 count=('Numeric_Rating', 'count')
             ).reset_index()
+            # 汇总结果行数很少，变体列转回普通类型，保证图表按平均评分排序展示
+            variant_stats[variant_col] = variant_stats[variant_col].astype(object)
             
             min_count = st.slider("最小评论数（过滤小样本量）：", 1, int(variant_stats['count'].max()), 
                                  max(1, int(variant_stats['count'].quantile(0.1))))
             
             variant_filtered = variant_stats[variant_stats['count'] >= min_count].sort_values(by='avg_rating')
 
-            fig_variant = px.bar(variant_filtered, 
-                                 x=variant_col, 
-                                 y='avg_rating', 
-                                 color='avg_rating',
-                                 title="各变体平均评分对比",
-                                 color_continuous_scale=px.colors.sequential.Plasma,
-                                 text_auto='.2f')
+            fig_variant = build_variant_bar(variant_filtered, variant_col)
             st.plotly_chart(fig_variant, use_container_width=True)
 
     except Exception as e: